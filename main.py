@@ -2,14 +2,41 @@
 # SPDX-License-Identifier: GPL-2.0
 # Copyright (C) 2024 Bardia Moshiri <bardia@furilabs.com>
 
+from sys import argv, exit
+from stktool import startup_profile
+
+# has to go before anything else is imported so those imports get timed too
+if "--profile-startup" in argv:
+    startup_profile.enable()
+
+import os
+
 import gi
 from gi.repository import GLib, Gio
 
-from sys import exit
-from stktool.stk import StkApp
-
 from asyncio import run, sleep
 
+RESOURCE_NAME = "io.FuriOS.StkTool.gresource"
+# a resource compiled in the source tree wins over the installed one
+RESOURCE_DIRS = [
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "data"),
+    "/usr/share/stktool",
+]
+
+def load_resources():
+    for directory in RESOURCE_DIRS:
+        path = os.path.join(directory, RESOURCE_NAME)
+        if os.path.exists(path):
+            Gio.Resource.load(path)._register()
+            return
+
+    exit(f"{RESOURCE_NAME} not found, compile data/io.FuriOS.StkTool.gresource.xml with glib-compile-resources")
+
+# the window template is looked up when stk_window is imported
+load_resources()
+from stktool.stk import StkApp
+from stktool import flight_recorder
+
 # these come from branchy. thank you jesus i love you
 async def pump_gtk_events():
     main_context = GLib.MainContext.default()
@@ -27,4 +54,5 @@ async def pump_gtk_events():
         await sleep(1 / 160)
 
 if __name__ == '__main__':
+    flight_recorder.install()
     run(pump_gtk_events())
@@ -0,0 +1,127 @@
+# SPDX-License-Identifier: GPL-2.0
+# Copyright (C) 2024 Bardia Moshiri <bardia@furilabs.com>
+
+import functools
+import os
+import signal
+import sys
+from time import monotonic, time, strftime, localtime
+
+# keeps the last SIZE agent events in memory so a misbehaving SIM session can be
+# looked at after the fact. recording only stores references into preallocated
+# slots, nothing gets formatted until dump() is called
+SIZE = 512
+# only this many dump files are kept, older ones are deleted
+KEEP_DUMPS = 10
+
+_times = [0.0] * SIZE
+_events = [None] * SIZE
+_args = [None] * SIZE
+_recorded = 0
+_dumps = 0
+
+def record(event, *args):
+    global _recorded
+    slot = _recorded % SIZE
+    _times[slot] = monotonic()
+    _events[slot] = event
+    _args[slot] = args
+    _recorded += 1
+
+# wraps reply and error callbacks handed to us by ofono so we see when they fire
+def recorded(event, callback):
+    def wrapper(*args):
+        record(event, *args)
+        return callback(*args)
+    return wrapper
+
+# exceptions are stored by name, holding on to one would keep its traceback and
+# every frame on it alive for as long as it sits in the buffer
+def describe(exception):
+    get_dbus_name = getattr(exception, "get_dbus_name", None)
+    if get_dbus_name is not None:
+        return get_dbus_name(), exception.args
+    return type(exception).__name__, exception.args
+
+# dump() can run inside the SIGUSR1 handler, print() there can hit a stdout write
+# that the handler interrupted and raise into it, so status goes straight to stderr
+def _status(message):
+    os.write(2, f"{message}\n".encode())
+
+def dump_dir():
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "stktool")
+
+def dump(reason):
+    global _dumps
+    _dumps += 1
+    now = monotonic()
+    wall_offset = time() - now
+    first = max(0, _recorded - SIZE)
+
+    directory = dump_dir()
+    path = os.path.join(directory, f"flight-recorder-{strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{_dumps}.log")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"reason: {reason}\n")
+            f.write(f"events: {_recorded - first} of {_recorded} recorded\n")
+            for index in range(first, _recorded):
+                slot = index % SIZE
+                stamp = _times[slot] + wall_offset
+                f.write(f"{strftime('%H:%M:%S', localtime(stamp))}.{int(stamp % 1 * 1000000):06d} "
+                        f"-{now - _times[slot]:.3f}s {_events[slot]}{_args[slot]!r}\n")
+    except OSError as e:
+        _status(f"Failed to dump flight recorder: {e}")
+        return None
+
+    _status(f"Flight recorder dumped to {path}")
+    prune_dumps(directory)
+    return path
+
+def prune_dumps(directory):
+    try:
+        dumps = [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith("flight-recorder-")]
+        dumps.sort(key=os.path.getmtime)
+        for old in dumps[:-KEEP_DUMPS]:
+            os.remove(old)
+    except OSError as e:
+        _status(f"Failed to prune flight recorder dumps: {e}")
+
+# python runs this between two bytecodes of the main thread, so it can land in the
+# middle of record(). that only leaves the slot being written with a mismatched
+# time and event, which is fine for a debugging dump. it also only runs once python
+# gets control back, so while a blocking dbus call like SelectItem or RegisterAgent
+# is waiting the dump is delayed until that call returns or times out
+def on_sigusr1(signum, frame):
+    dump("SIGUSR1")
+
+# dbus-python turns exceptions raised in agent methods into error replies to ofono,
+# they never reach sys.excepthook. goes above @dbus.service.method, functools.wraps
+# carries over the attributes dbus-python uses to export the method
+def dumps_on_exception(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            record(f"{method.__name__} exception", *describe(e))
+            dump(f"{method.__name__} raised {type(e).__name__}: {e}")
+            raise
+    return wrapper
+
+def install():
+    signal.signal(signal.SIGUSR1, on_sigusr1)
+
+    previous_excepthook = sys.excepthook
+
+    def excepthook(exc_type, exc_value, exc_traceback):
+        if issubclass(exc_type, KeyboardInterrupt):
+            previous_excepthook(exc_type, exc_value, exc_traceback)
+            return
+
+        record("exception", *describe(exc_value))
+        dump(f"unhandled {exc_type.__name__}: {exc_value}")
+        previous_excepthook(exc_type, exc_value, exc_traceback)
+
+    sys.excepthook = excepthook
@@ -7,6 +7,8 @@ from gi.repository import GLib
 import dbus
 import dbus.service
 
+from stktool import flight_recorder
+
 # the skel implementation here comes from test-stk-menu but all the logic is stripped out and moved to StkWindow to handle and draw
 class GoBack(dbus.DBusException):
     _dbus_error_name = "org.ofono.Error.GoBack"
@@ -20,6 +22,10 @@ class Busy(dbus.DBusException):
 class StkAgent(dbus.service.Object):
     timeout_id = 0
     timeout_reply_handler = None
+    # set while we expect ofono to release us, either because we unregistered the
+    # default agent or because a SelectItem session on our path is running
+    unregistering = False
+    session_active = False
 
     def __init__(self, bus, path, window):
         super().__init__(bus, path)
@@ -32,112 +38,175 @@ class StkAgent(dbus.service.Object):
 
     def call_added(self, path, properties):
         # print("call added %s" % (path))
+        flight_recorder.record("CallAdded", path)
         # so basically if there is a call operation going on we need to hold as stk won't answer, do something with this
         if (self.timeout_id > 0):
             GLib.source_remove(self.timeout_id)
             self.timeout_callback()
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="", out_signature="")
     def Release(self):
         print("Release")
-
+        flight_recorder.record("Release")
+        # sessions end with a Release and we release ourselves on every cancel,
+        # only dump when ofono drops the default agent on its own
+        if self.session_active:
+            self.session_active = False
+        elif self.unregistering:
+            self.unregistering = False
+        else:
+            flight_recorder.dump("Release")
+
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                          in_signature="sya(sy)n", out_signature="y",
                          async_callbacks=("reply_callback", "error_callback"))
     def RequestSelection(self, title, icon, items, default, reply_callback, error_callback):
         # print(f"RequestSelection: title: {title}, icon: {icon}, items: {items}, default: {default}")
+        flight_recorder.record("RequestSelection", title, icon, items, default)
+        reply_callback = flight_recorder.recorded("RequestSelection reply", reply_callback)
+        error_callback = flight_recorder.recorded("RequestSelection error", error_callback)
         self.window.show_selection_page(title, items, default, reply_callback, error_callback)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                          in_signature="syb", out_signature="",
                          async_callbacks=("reply_func", "error_func"))
     def DisplayText(self, title, icon, urgent, reply_func, error_func):
         # print(f"DisplayText: title: {title}, icon: {icon}, urgent: {urgent}")
+        flight_recorder.record("DisplayText", title, icon, urgent)
+        reply_func = flight_recorder.recorded("DisplayText reply", reply_func)
+        error_func = flight_recorder.recorded("DisplayText error", error_func)
         self.window.show_display_text_popup(title, reply_func, error_func)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sysyyb", out_signature="s",
                 async_callbacks=("reply_func", "error_func"))
     def RequestInput(self, title, icon, default, min_chars, max_chars, hide_typing, reply_func, error_func):
         # print(f"RequestInput: title: {title}, icon: {icon}, default: {default}, min_chars: {min_chars}, max_chars: {max_chars}, hide_typing: {hide_typing}")
+        flight_recorder.record("RequestInput", title, icon, default, min_chars, max_chars, hide_typing)
+        reply_func = flight_recorder.recorded("RequestInput reply", reply_func)
+        error_func = flight_recorder.recorded("RequestInput error", error_func)
         self.window.show_input_page(title, default, min_chars, reply_func, error_func)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sysyyb", out_signature="s",
                 async_callbacks=("reply_func", "error_func"))
     def RequestDigits(self, title, icon, default, min_chars, max_chars, hide_typing, reply_func, error_func):
         # print(f"RequestDigits: title: {title}, icon: {icon}, default: {default}, min_chars: {min_chars}, max_chars: {max_chars}, hide_typing: {hide_typing}")
+        flight_recorder.record("RequestDigits", title, icon, default, min_chars, max_chars, hide_typing)
+        reply_func = flight_recorder.recorded("RequestDigits reply", reply_func)
+        error_func = flight_recorder.recorded("RequestDigits error", error_func)
         self.window.show_input_page(title, default, reply_func, error_func, digits_only=True)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sy", out_signature="s",
                 async_callbacks=("reply_func", "error_func"))
     def RequestKey(self, title, icon, reply_func, error_func):
         # print(f"RequestKey: title: {title}, icon: {icon}")
+        flight_recorder.record("RequestKey", title, icon)
+        reply_func = flight_recorder.recorded("RequestKey reply", reply_func)
+        error_func = flight_recorder.recorded("RequestKey error", error_func)
         self.window.show_key_page(title, reply_func, error_func)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sy", out_signature="s",
                 async_callbacks=("reply_func", "error_func"))
     def RequestDigit(self, title, icon, reply_func, error_func):
         # print(f"RequestDigit: title: {title}, icon: {icon}")
+        flight_recorder.record("RequestDigit", title, icon)
+        reply_func = flight_recorder.recorded("RequestDigit reply", reply_func)
+        error_func = flight_recorder.recorded("RequestDigit error", error_func)
         self.window.show_key_page(title, reply_func, error_func, digits_only=True)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sy", out_signature="b",
                 async_callbacks=("reply_func", "error_func"))
     def RequestConfirmation(self, title, icon, reply_func, error_func):
         # print(f"RequestConfirmation: title: {title}, icon: {icon}")
+        flight_recorder.record("RequestConfirmation", title, icon)
+        reply_func = flight_recorder.recorded("RequestConfirmation reply", reply_func)
+        error_func = flight_recorder.recorded("RequestConfirmation error", error_func)
         self.window.show_confirmation_popup(title, reply_func, error_func)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sy", out_signature="b",
                 async_callbacks=("reply_func", "error_func"))
     def ConfirmCallSetup(self, info, icon, reply_func, error_func):
         # print(f"ConfirmCallSetup: info: {info}, icon: {icon}")
+        flight_recorder.record("ConfirmCallSetup", info, icon)
+        reply_func = flight_recorder.recorded("ConfirmCallSetup reply", reply_func)
+        error_func = flight_recorder.recorded("ConfirmCallSetup error", error_func)
         self.window.show_confirmation_popup("Confirm Call Setup", reply_func, error_func, info=info)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                 in_signature="sys", out_signature="b",
                 async_callbacks=("reply_func", "error_func"))
     def ConfirmLaunchBrowser(self, info, icon, url, reply_func, error_func):
         # print(f"ConfirmLaunchBrowser: info: {info}, icon: {icon}, url: {url}")
+        flight_recorder.record("ConfirmLaunchBrowser", info, icon, url)
+        reply_func = flight_recorder.recorded("ConfirmLaunchBrowser reply", reply_func)
+        error_func = flight_recorder.recorded("ConfirmLaunchBrowser error", error_func)
         self.window.show_confirmation_popup("Confirm Launch Browser", reply_func, error_func, info=info, url=url)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="", out_signature="")
     def Cancel(self):
         # print("Cancel")
+        flight_recorder.record("Cancel")
         self.window.pop_to_main_page()
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="ssy", out_signature="")
     def PlayTone(self, tone, text, icon):
         # print(f"PlayTone: tone: {tone}, text: {text}, icon: {icon}")
+        flight_recorder.record("PlayTone", tone, text, icon)
         self.window.show_tone_page(tone, text)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="ssy", out_signature="",
                     async_callbacks=("reply_func", "error_func"))
     def LoopTone(self, tone, text, icon, reply_func, error_func):
         # print(f"LoopTone: tone: {tone}, text: {text}, icon: {icon}")
+        flight_recorder.record("LoopTone", tone, text, icon)
+        reply_func = flight_recorder.recorded("LoopTone reply", reply_func)
+        error_func = flight_recorder.recorded("LoopTone error", error_func)
         self.window.show_loop_tone_page(tone, text, reply_func, error_func)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="sy", out_signature="")
     def DisplayActionInformation(self, text, icon):
         # print(f"DisplayActionInformation: text: {text}, icon: {icon}")
+        flight_recorder.record("DisplayActionInformation", text, icon)
         self.window.show_action_info_popup(text)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="sy", out_signature="")
     def DisplayAction(self, text, icon):
         # print(f"DisplayAction: text: {text}, icon: {icon}")
+        flight_recorder.record("DisplayAction", text, icon)
         self.window.show_action_page(text)
 
+    @flight_recorder.dumps_on_exception
     @dbus.service.method("org.ofono.SimToolkitAgent",
                     in_signature="sy", out_signature="b")
     def ConfirmOpenChannel(self, info, icon):
         # print(f"ConfirmOpenChannel: info: {info}, icon: {icon}")
-        return self.window.show_confirm_open_channel_page(info)
+        flight_recorder.record("ConfirmOpenChannel", info, icon)
+        confirmed = self.window.show_confirm_open_channel_page(info)
+        flight_recorder.record("ConfirmOpenChannel reply", confirmed)
+        return confirmed
@@ -0,0 +1,98 @@
+# SPDX-License-Identifier: GPL-2.0
+# Copyright (C) 2024 Bardia Moshiri <bardia@furilabs.com>
+
+# only stdlib modules that the interpreter has already loaded are used here,
+# this has to be importable before gi so it can see everything after it
+import sys
+from time import perf_counter
+
+# timings are in seconds since enable(), reported in milliseconds
+_profiler = None
+
+class _TimedLoader:
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    # gi.repository does the typelib loading in create_module, python modules in exec_module
+    def create_module(self, spec):
+        create_module = getattr(self._loader, "create_module", None)
+        if create_module is None:
+            return None
+        return self._profiler.timed(spec.name, create_module, spec)
+
+    def exec_module(self, module):
+        self._profiler.timed(module.__name__, self._loader.exec_module, module)
+
+class StartupProfiler:
+    def __init__(self):
+        self.start = perf_counter()
+        self.imports = {}
+        self.marks = []
+        self._nested = []
+
+    # sits first on sys.meta_path and wraps whatever loader the real finders return
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+    def timed(self, name, func, arg):
+        self._nested.append(0.0)
+        begin = perf_counter()
+        try:
+            return func(arg)
+        finally:
+            elapsed = perf_counter() - begin
+            nested = self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+            own, cumulative = self.imports.get(name, (0.0, 0.0))
+            self.imports[name] = (own + elapsed - nested, cumulative + elapsed)
+
+    def mark(self, label):
+        self.marks.append((label, perf_counter() - self.start))
+
+    def report(self, file=sys.stderr):
+        print("startup profile, import times in ms:", file=file)
+        print(f"{'self':>9} {'cumulative':>11}  module", file=file)
+        for name, (own, cumulative) in sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True):
+            print(f"{own * 1000:9.2f} {cumulative * 1000:11.2f}  {name}", file=file)
+
+        total = sum(own for own, _ in self.imports.values())
+        print(f"{total * 1000:9.2f} {'':11}  total in imports", file=file)
+
+        for label, elapsed in self.marks:
+            print(f"{elapsed * 1000:9.2f} ms until {label}", file=file)
+
+def enable():
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        sys.meta_path.insert(0, _profiler)
+
+def mark(label):
+    if _profiler is not None:
+        _profiler.mark(label)
+
+# prints once and stops timing, anything imported later is not part of startup
+def report():
+    global _profiler
+    if _profiler is None:
+        return
+
+    sys.meta_path.remove(_profiler)
+    _profiler.report()
+    _profiler = None
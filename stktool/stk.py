@@ -5,6 +5,7 @@ import gi
 gi.require_version('Adw', '1')
 from gi.repository import Adw
 
+from stktool import startup_profile
 from stktool.stk_window import StkWindow
 
 class StkApp(Adw.Application):
@@ -15,3 +16,4 @@ class StkApp(Adw.Application):
     def on_activate(self, app):
         self.win = StkWindow(application=app)
         self.win.present()
+        startup_profile.mark("present()")
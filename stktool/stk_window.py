@@ -4,71 +4,63 @@
 import gi
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-from gi.repository import Gtk, Adw, GLib, Pango
+from gi.repository import Gtk, Adw, GLib
 
-import dbus
-import dbus.mainloop.glib
-
-from stktool.ofono_stk_agent import StkAgent, GoBack, EndSession, Busy
+from stktool import startup_profile
+from stktool import flight_recorder
 
+# dbus, the ofono agent and Pango are imported where they are first used so
+# the main window can be presented before any of them are loaded
+@Gtk.Template(resource_path='/io/FuriOS/StkTool/ui/stk-window.ui')
 class StkWindow(Adw.ApplicationWindow):
+    __gtype_name__ = 'StkWindow'
+
+    toast_overlay = Gtk.Template.Child()
+    navigation_view = Gtk.Template.Child()
+    main_page = Gtk.Template.Child()
+    main_box = Gtk.Template.Child()
+    main_menu_title = Gtk.Template.Child()
+    scrolled_window = Gtk.Template.Child()
+    list_box = Gtk.Template.Child()
+    listbox = Gtk.Template.Child()
+    ok_button = Gtk.Template.Child()
+    cancel_button = Gtk.Template.Child()
+    unavailable_page = Gtk.Template.Child()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.connect("close-request", lambda _: exit(0))
-        self.set_title("SIM Toolkit")
-        self.set_default_size(400, 600)
-
-        self.toast_overlay = Adw.ToastOverlay()
-        self.set_content(self.toast_overlay)
-
-        self.navigation_view = Adw.NavigationView()
-        self.toast_overlay.set_child(self.navigation_view)
-
-        self.main_page = self.create_non_swipeable_page("SIM Toolkit")
-        self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
-        self.main_page.set_child(self.main_box)
-
-        self.main_menu_title = Adw.StatusPage()
-        self.main_box.append(self.main_menu_title)
-
-        self.scrolled_window = Gtk.ScrolledWindow()
-        self.scrolled_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-        self.scrolled_window.set_min_content_height(400)
-        self.scrolled_window.set_vexpand(True)
-        self.main_box.append(self.scrolled_window)
-
-        self.list_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
-        self.scrolled_window.set_child(self.list_box)
-
-        self.listbox = Gtk.ListBox()
-        self.listbox.set_selection_mode(Gtk.SelectionMode.SINGLE)
-        self.listbox.add_css_class("boxed-list")
-        self.list_box.append(self.listbox)
-
-        button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
-        button_box.set_margin_top(12)
-        button_box.set_margin_bottom(24)
-        button_box.set_halign(Gtk.Align.CENTER)
-        self.main_box.append(button_box)
-
-        self.ok_button = Gtk.Button(label="OK")
-        self.ok_button.connect("clicked", self.on_ok_clicked)
-        button_box.append(self.ok_button)
-
-        self.cancel_button = Gtk.Button(label="Cancel")
-        self.cancel_button.connect("clicked", self.on_cancel_clicked)
-        button_box.append(self.cancel_button)
-
-        self.navigation_view.add(self.main_page)
 
         self.agent_path = "/appagent"
         self.agent = None
         self.stk = None
         self.vcm = None
 
-        self.setup_stk()
+        # talking to ofono blocks, let the window show up first
+        GLib.idle_add(self.setup_stk)
 
     def setup_stk(self):
+        try:
+            registered = self.connect_stk()
+            startup_profile.mark("ofono agent registered" if registered else "ofono setup done, agent not registered")
+        except Exception as e:
+            # no ofono or no modem with a SIM toolkit, there is nothing to show but the unavailable page
+            flight_recorder.record("setup exception", *flight_recorder.describe(e))
+            print(f"Failed to set up SIM toolkit: {e}")
+            self.scrolled_window.set_child(self.unavailable_page)
+            startup_profile.mark("ofono setup failed")
+        finally:
+            startup_profile.report()
+        return False
+
+    def connect_stk(self):
+        import dbus
+        import dbus.mainloop.glib
+        from stktool.ofono_stk_agent import StkAgent
+
+        # kept for the handlers below, none of them can run before this
+        self.dbus = dbus
+
         dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
         self.bus = dbus.SystemBus()
         manager = dbus.Interface(self.bus.get_object("org.ofono", "/"), "org.ofono.Manager")
@@ -83,7 +75,7 @@ class StkWindow(Adw.ApplicationWindow):
         self.properties = self.stk.GetProperties()
 
         self.agent = StkAgent(self.bus, self.agent_path, self)
-        self.register_agent()
+        registered = self.register_agent()
 
         try:
             self.vcm.connect_to_signal("CallAdded", self.agent.call_added)
@@ -91,6 +83,7 @@ class StkWindow(Adw.ApplicationWindow):
             print("Failed to connect to signal CallAdded") # i... don't know?
 
         self.update_ui()
+        return registered
 
     def update_ui(self):
         if "MainMenuTitle" in self.properties:
@@ -110,30 +103,36 @@ class StkWindow(Adw.ApplicationWindow):
             if self.listbox.get_row_at_index(0):
                 self.listbox.select_row(self.listbox.get_row_at_index(0))
         else:
-            status_page = Adw.StatusPage()
-            status_page.set_icon_name("dialog-warning-symbolic")
-            status_page.set_title("SIM Toolkit Unavailable")
-            status_page.set_description("SIM Toolkit is not available right now")
-            self.scrolled_window.set_child(status_page)
+            self.scrolled_window.set_child(self.unavailable_page)
 
             self.ok_button.set_sensitive(False)
             self.cancel_button.set_sensitive(False)
 
     def property_changed(self, name, value):
         # print(f"property changed: name: {name}, value: {value}")
+        flight_recorder.record("PropertyChanged", name, value)
         self.properties[name] = value
         GLib.idle_add(self.update_ui)
 
+    @Gtk.Template.Callback()
     def on_ok_clicked(self, button):
         selected_row = self.listbox.get_selected_row()
         if selected_row:
             # print(f"Selected item index: {selected_row.get_index()}")
+            flight_recorder.record("SelectItem", selected_row.get_index())
+            # ofono runs the session with our path as its agent and releases it when done
+            self.agent.session_active = True
             try:
-                self.stk.SelectItem(selected_row.get_index(), "/appagent")
-            except dbus.exceptions.DBusException as e:
+                self.stk.SelectItem(selected_row.get_index(), self.agent_path)
+                flight_recorder.record("SelectItem reply")
+            except self.dbus.exceptions.DBusException as e:
+                self.agent.session_active = False
+                flight_recorder.record("SelectItem error", *flight_recorder.describe(e))
                 self.show_toast("Operation in progress. Please wait.")
                 print(f"on_ok_clicked: dbus exception: {e}")
             except Exception as e:
+                self.agent.session_active = False
+                flight_recorder.record("SelectItem error", *flight_recorder.describe(e))
                 self.show_toast("{e}")
                 printf(f"on_ok_clicked: general exception: {e}")
         else:
@@ -150,20 +149,32 @@ class StkWindow(Adw.ApplicationWindow):
         GLib.timeout_add_seconds(duration, dismiss_toast)
 
     def register_agent(self):
+        flight_recorder.record("RegisterAgent", self.agent_path)
         try:
             self.stk.RegisterAgent(self.agent_path)
-        except dbus.exceptions.DBusException as e:
+            flight_recorder.record("RegisterAgent reply")
+            return True
+        except self.dbus.exceptions.DBusException as e:
+            flight_recorder.record("RegisterAgent error", *flight_recorder.describe(e))
             self.show_toast(f"Failed to register agent: {str(e)}")
             print(f"Failed to register agent: {str(e)}")
+            return False
 
     def unregister_agent(self):
+        flight_recorder.record("UnregisterAgent", self.agent_path)
+        # ofono answers with Release, which must not be dumped like an unexpected one
+        self.agent.unregistering = True
         try:
             self.stk.UnregisterAgent(self.agent_path)
-        except dbus.exceptions.DBusException as e:
+            flight_recorder.record("UnregisterAgent reply")
+        except self.dbus.exceptions.DBusException as e:
+            self.agent.unregistering = False
+            flight_recorder.record("UnregisterAgent error", *flight_recorder.describe(e))
             self.show_toast(f"Failed to unregister agent: {str(e)}")
             print(f"Failed to unregister agent: {str(e)}")
 
     # this is cancel in the main menu
+    @Gtk.Template.Callback()
     def on_cancel_clicked(self, button):
         self.unregister_agent()
         self.register_agent()
@@ -194,6 +205,9 @@ class StkWindow(Adw.ApplicationWindow):
         dialog.present()
 
     def show_input_page(self, title, default, reply_func, error_func, digits_only=False):
+        from gi.repository import Pango
+        from stktool.ofono_stk_agent import Busy
+
         page = self.create_non_swipeable_page(title)
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
         page.set_child(box)
@@ -290,13 +304,13 @@ class StkWindow(Adw.ApplicationWindow):
             if selected_row:
                 selection = selected_row.get_index()
                 self.navigation_view.pop()
-                GLib.idle_add(reply_callback, dbus.Byte(selection))
+                GLib.idle_add(reply_callback, self.dbus.Byte(selection))
             else:
                 self.show_toast("Please select an option")
 
         def on_cancel_clicked(button):
             self.navigation_view.pop()
-            GLib.idle_add(reply_callback, dbus.Byte(255))
+            GLib.idle_add(reply_callback, self.dbus.Byte(255))
             self.unregister_agent()
             self.register_agent()
 
@@ -307,6 +321,9 @@ class StkWindow(Adw.ApplicationWindow):
         self.navigation_view.push(page)
 
     def show_key_page(self, title, reply_func, error_func, digits_only=False):
+        from gi.repository import Pango
+        from stktool.ofono_stk_agent import GoBack
+
         page = self.create_non_swipeable_page(title)
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
         page.set_child(box)